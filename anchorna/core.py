@@ -12,11 +12,12 @@ import logging
 import multiprocessing
 from warnings import warn
 
+import numpy as np
 from sugar import BioBasket
 from sugar.data import submat
 from tqdm import tqdm
 
-from anchorna.util import _apply_mode, corrscore, Anchor, AnchorList, Fluke
+from anchorna.util import _apply_mode, corrscore, corrscores, Anchor, AnchorList, Fluke
 
 log = logging.getLogger('anchorna')
 
@@ -52,13 +53,13 @@ def shift_and_find_best_word(seq, word, starti, w, sm, maxshift=None, maxshift_r
         maxshift = len(seq)
     if maxshift_right is None:
         maxshift_right = maxshift
-    siminds = maxes([(corrscore(seq[i:i+w], word, sm=sm), i)
-                      for i in range(max(0, starti-maxshift_right),
-                                     min(len(seq)-w, starti+maxshift+1))],
-                     default=(0, None))
-    sim, ind = min((abs(ind - starti), sim, ind) for sim, ind in siminds)[1:]
-    if len(siminds) > 1:
-        log.warning(f'multiple max values exist: {siminds=}, select {sim=}, {ind=} with smallest shift')
+    i0 = max(0, starti-maxshift_right)
+    scores = corrscores(seq, word, i0, min(len(seq)-w, starti+maxshift+1), w=w, sm=sm)
+    if len(scores) == 0:
+        return 0, None
+    sim = scores.max().item()
+    # on ties select the word with the largest index
+    ind = np.flatnonzero(scores == sim)[-1].item() + i0
     return sim, ind
 
 
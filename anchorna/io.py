@@ -3,16 +3,24 @@
 IO routines, see `.write_anchors()` and `.read_anchors()`
 """
 
+from copy import deepcopy
+from functools import lru_cache
+from io import StringIO
+from itertools import chain
 import json
 import logging
+import os
 import sys
 
-import matplotlib.colors as mcolors
-from matplotlib.colors import to_hex, to_rgb
 from sugar import read_fts
 
 from anchorna.util import _apply_mode, fts2anchors, Anchor, AnchorList, Fluke
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 log = logging.getLogger('anchorna')
 
@@ -28,8 +36,9 @@ def write_anchors(anchors, fname, mode=None):
        The result is a file which should not be read in again with anchorna.
     """
     from anchorna import __version__
-    fts = anchors.convert2fts(mode=mode)
-    offsets = {ft.seqid: ft.meta._gff.pop('offset') for ft in fts}
+    # offsets are stored in the header and not as feature attributes
+    fts = anchors.convert2fts(mode=mode, offset=False)
+    offsets = {f.seqid: f.offset for anchor in anchors for f in anchor}
     offsets_header = ''.join(f'#offset {seqid} {offset}\n' for seqid, offset in offsets.items())
     if mode is None:
         header_cds = '#no_cds\n' if anchors.no_cds else (
@@ -51,30 +60,48 @@ def write_anchors(anchors, fname, mode=None):
         fts.write(fname, 'gff', header=header)
 
 
+@lru_cache(maxsize=32)
+def _read_anchors_cached(fname, mtime, size, check_header=True):
+    """
+    Cached version of `_read_anchors()`, modification time and size are part of the key
+    """
+    return _read_anchors_uncached(fname, check_header=check_header)
+
+
 def _read_anchors(fname, check_header=True):
     """
     Read anchors from GFF file
 
     Offsets are restored from comments.
+    Anchors read from the same unmodified file are taken from a cache,
+    a deep copy is returned, because callers may change the anchors.
     """
+    if isinstance(fname, str) and os.path.isfile(fname):
+        fname = os.path.abspath(fname)
+        stat = os.stat(fname)
+        anchors = _read_anchors_cached(fname, stat.st_mtime_ns, stat.st_size,
+                                       check_header=check_header)
+        return deepcopy(anchors)
+    return _read_anchors_uncached(fname, check_header=check_header)
+
+
+def _read_anchors_uncached(fname, check_header=True):
     comments = []
     fts = read_fts(fname, 'gff', comments=comments)
     offsets = {}
     no_cds = False
-    for i, line in enumerate(comments):
-        if i == 0:
-            if check_header and not line.startswith('##gff-version 3'):
-                raise IOError(f'{fname} not a valid GFF file')
-        elif i == 1:
-            if check_header and not line.startswith('#AnchoRNA'):
-                raise IOError(f'{fname} not a valid anchor file')
-        elif line.startswith('#no_cds'):
-            no_cds = True
-        elif line.startswith('#offset'):
+    if check_header:
+        if len(comments) > 0 and not comments[0].startswith('##gff-version 3'):
+            raise IOError(f'{fname} not a valid GFF file')
+        if len(comments) > 1 and not comments[1].startswith('#AnchoRNA'):
+            raise IOError(f'{fname} not a valid anchor file')
+    # the first two lines are the header, offset lines are the most frequent ones
+    for line in comments[2:]:
+        if line.startswith('#offset'):
             seqid, offset = line.split()[1:]
             offsets[seqid] = int(offset)
-        elif line.startswith('#'):
-            continue
+        elif line.startswith('#no_cds'):
+            no_cds = True
     for ft in fts:
         ft.meta._gff.offset = offsets.get(ft.seqid)
     return fts2anchors(fts, no_cds=no_cds)
@@ -86,7 +113,7 @@ def _parse_selection(anchors, selection):
 
     See ``anchorna combine -h``
     """
-    anchors2 = anchors[:0]
+    ranges = []
     for part in selection.split(','):
         if ':' in part:
             i, j = part.split(':')
@@ -95,7 +122,9 @@ def _parse_selection(anchors, selection):
         else:
             i = int(part.strip().removeprefix('a'))
             j = i + 1
-        anchors2.extend(anchors[i:j])
+        ranges.append((i, j))
+    anchors2 = anchors[:0]
+    anchors2.extend(chain.from_iterable(anchors.data[i:j] for i, j in ranges))
     return anchors2
 
 
@@ -116,21 +145,24 @@ def read_anchors(fname, check_header=True):
     if '|' not in selection:
         return _parse_selection(anchors, selection)
     selection, rem = selection.split('|')
-    anchors_remove = set(_parse_selection(anchors, rem))
+    # selections contain the same anchor objects, compare by identity
+    remove_ids = {id(a) for a in _parse_selection(anchors, rem)}
     anchors = _parse_selection(anchors, selection) if selection.strip() else anchors
-    anchors.data = [a for a in anchors if a not in anchors_remove]
+    anchors.data = [a for a in anchors if id(a) not in remove_ids]
     return anchors
 
 
+def _json_default(o):
+    if isinstance(o, (Anchor, AnchorList, Fluke)):
+        obj = o.__dict__.copy()
+        obj['_cls'] = type(o).__name__
+        return obj
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
 class _AnchorJSONEncoder(json.JSONEncoder):
     def default(self, o):
-        if isinstance(o, (Anchor, AnchorList, Fluke)):
-            obj = {k: v for k, v in o.__dict__.items()}
-            obj['_cls'] = type(o).__name__
-            return obj
-        else:
-            # Let the base class default method raise the TypeError
-            return json.JSONEncoder.default(self, o)
+        return _json_default(o)
 
 
 def _json_hook(d):
@@ -140,11 +172,29 @@ def _json_hook(d):
         return d
 
 
+def _apply_json_hook(obj):
+    # apply the hook bottom-up, like the object_hook of the json module
+    if isinstance(obj, dict):
+        return _json_hook({k: _apply_json_hook(v) for k, v in obj.items()})
+    elif isinstance(obj, list):
+        return [_apply_json_hook(v) for v in obj]
+    return obj
+
+
 def load_json(fname):
     """
     Load anchors from JSON file, experimental
-    """
 
+    orjson is used for parsing, if it is installed.
+    """
+    if orjson is not None:
+        if fname in ('-', None):
+            # stdin may be replaced by a text stream without binary buffer
+            data = getattr(sys.stdin, 'buffer', sys.stdin).read()
+        else:
+            with open(fname, 'rb') as f:
+                data = f.read()
+        return _apply_json_hook(orjson.loads(data))
     if fname in ('-', None):
         return json.loads(sys.stdin.read(), object_hook=_json_hook)
     else:
@@ -155,12 +205,38 @@ def load_json(fname):
 def write_json(obj, fname):
     """
     Write anchors to JSON file, experimental
+
+    orjson is used for serialization, if it is installed.
     """
-    if fname in ('-', None):
-        print(json.dumps(obj, cls=_AnchorJSONEncoder))
+    if orjson is not None:
+        data = orjson.dumps(obj, default=_json_default)
+        if fname in ('-', None):
+            try:
+                if hasattr(sys.stdout, 'buffer'):
+                    sys.stdout.flush()
+                    sys.stdout.buffer.write(data + b'\n')
+                else:
+                    # stdout may be replaced by a text stream without binary buffer
+                    sys.stdout.write(data.decode() + '\n')
+            except BrokenPipeError:
+                pass
+        else:
+            with open(fname, 'wb') as f:
+                f.write(data)
     else:
-        with open(fname, 'w') as f:
-            json.dump(obj, f, cls=_AnchorJSONEncoder)
+        # write chunks directly, the full JSON string is never built
+        chunks = _AnchorJSONEncoder().iterencode(obj)
+        if fname in ('-', None):
+            try:
+                for chunk in chunks:
+                    sys.stdout.write(chunk)
+                sys.stdout.write('\n')
+            except BrokenPipeError:
+                pass
+        else:
+            with open(fname, 'w', buffering=1 << 20) as f:
+                for chunk in chunks:
+                    f.write(chunk)
 
 
 def export_dialign(anchors, seqids, mode='aa', score_use_fluke=None):
@@ -169,30 +245,55 @@ def export_dialign(anchors, seqids, mode='aa', score_use_fluke=None):
     """
     assert mode in ('nt', 'cds', 'aa')
     sortkey_score = lambda f: f.score
-    sortkey_ids = lambda f: seqids.index(f.seqid)
-    content = []
+    seqid_index = {seqid: k for k, seqid in enumerate(seqids)}
+    sortkey_ids = lambda f: seqid_index[f.seqid]
+    content = StringIO()
     for anchor in anchors:
-        f0 = anchor.sort(key=sortkey_score)[-1]
+        # iterate in reverse order to select the same fluke as sorting by score
+        f0 = max(reversed(anchor.data), key=sortkey_score)
         start0 = _apply_mode(f0.start, f0.offset, mode)
+        # all flukes of an anchor have the same length
+        len_ = _apply_mode(f0.len, f0.offset, mode, islen=True)
         i = sortkey_ids(f0)
         anchor.sort(key=sortkey_ids)
         for f in anchor:
             j = sortkey_ids(f)
-            if (f == f0 or score_use_fluke is not None and
+            if (f is f0 or score_use_fluke is not None and
                     f.score < score_use_fluke):
                 continue
             assert f.len == f0.len
             start = _apply_mode(f.start, f.offset, mode)
-            len_ = _apply_mode(f.len, f.offset, mode, islen=True)
-            content.append(
+            content.write(
                 f'{i+1} {j+1} {start0+1} {start+1} {len_} {f.score}\n'
                 )
-    return ''.join(content)
+    return content.getvalue()
 
 
-def _make_rgb_transparent(rgb, bg_rgb, alpha):
-    return [alpha * c1 + (1 - alpha) * c2
-            for (c1, c2) in zip(to_rgb(rgb), to_rgb(bg_rgb))]
+def _blend_white(rgb, alpha):
+    """
+    Make RGB color transparent on white background
+    """
+    r, g, b = rgb
+    return (alpha * r + (1 - alpha), alpha * g + (1 - alpha), alpha * b + (1 - alpha))
+
+
+@lru_cache(maxsize=4096)
+def _hex_for(rgb, alpha):
+    """
+    Hex code of RGB color blended with white background, cached
+    """
+    from matplotlib.colors import to_hex
+    return to_hex(_blend_white(rgb, alpha)).strip('#')
+
+
+@lru_cache(maxsize=None)
+def _tableau_rgb():
+    """
+    Tuple of RGB values of the Tableau colors, cached
+    """
+    # matplotlib is imported here, because the import is slow
+    from matplotlib.colors import TABLEAU_COLORS, to_rgb
+    return tuple(to_rgb(c) for c in TABLEAU_COLORS.values())
 
 
 def export_jalview(anchors, mode='aa', score_use_fluke=None):
@@ -200,26 +301,29 @@ def export_jalview(anchors, mode='aa', score_use_fluke=None):
     Export anchors to Jalview feature file
     """
     assert mode in ('nt', 'cds', 'aa')
-    cols = list(mcolors.TABLEAU_COLORS.values())
+    cols = _tableau_rgb()
     anchors = sorted(anchors, key=lambda a: a.guide.start)
-    content = []
-    header = []
+    content = StringIO()
+    header = StringIO()
     for k, a in enumerate(anchors):
         poor = sum(f.poor for f in a)
+        w = a.guide.len
+        maxscore = a.maxscore
+        col = cols[k % len(cols)]
         for j, f in enumerate(a):
             if score_use_fluke is not None and f.score < score_use_fluke:
                 continue
             # anchor2	C_CSFV_KC533775	-1	130	150	anchorsim	1.0
             # anchor100	D_BDV_NC_003679	-1	10	20	anchorxx
-            w = a.guide.len
-            score_ = max(1, f.median_score) / a.maxscore
-            c = to_hex(_make_rgb_transparent(cols[k % len(cols)], 'white', score_)).strip('#')
+            score_ = max(1, f.median_score) / maxscore
+            c = _hex_for(col, score_)
             al = f'anchor{k}_s{f.median_score}'
-            header.append(
+            header.write(
                 f'{al}\t{c}\n'
                 )
             i = _apply_mode(f.start, f.offset, mode)
             j = _apply_mode(f.stop, f.offset, mode)
-            content.append(f'{f.word[:5]} w{w} poor:{poor}\t{f.seqid}\t-1\t{i+1}\t{j}\t{al}\n')
-    header.append('\nSTARTFILTERS\nENDFILTERS\n\n')
-    return ''.join(header) + ''.join(content)
+            content.write(f'{f.word[:5]} w{w} poor:{poor}\t{f.seqid}\t-1\t{i+1}\t{j}\t{al}\n')
+    header.write('\nSTARTFILTERS\nENDFILTERS\n\n')
+    header.write(content.getvalue())
+    return header.getvalue()
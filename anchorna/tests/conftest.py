@@ -13,6 +13,8 @@ def pytest_collection_modifyitems(config, items):
                 item.add_marker(skip_slow)
     # explicitly add filter warnings to markers so that they have a higher
     # priority than command line options, e.g. -W error
+    fwarn_marks = [pytest.mark.filterwarnings(fwarn)
+                   for fwarn in config.getini('filterwarnings')]
     for item in items:
-        for fwarn in config.getini('filterwarnings'):
-            item.add_marker(pytest.mark.filterwarnings(fwarn))
+        for mark in fwarn_marks:
+            item.add_marker(mark)
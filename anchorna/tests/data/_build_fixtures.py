@@ -0,0 +1,32 @@
+# (C) 2024, Tom Eulenfeld, MIT license
+"""
+Script to create the example sequences file in the tests/data folder
+"""
+import os.path
+
+
+_IDS = (  # Representative sequences of pesti virus
+    'NC_076029 NC_001461 KC853440 JX419398 M96687 KT951841 ON165517 KX577637 '
+    'MW054939 AF526381 JQ799141 NC_076032 NC_039237 MH231152 KT875135 '
+    'MH806436 HG426490 MK599227 JN380086 NC_038912 NC_002657 OM817567 '
+    'GU233732 KP343640 KC533775 AY805221 AF099102 AY775178 MG387218 '
+    'NC_003679 MF102261 NC_024018 NC_023176 NC_003678 NC_012812 NC_018713 '
+    'NC_025677 NC_038964 NC_030653 MK216749 MH221025 MN099165 MN584738 '
+    'NC_035432 NC_077026 MZ664274 NC_077023 NC_077024 ON024093 ON024108 '
+    'NC_077001 NC_077000 NC_077015 OU592965 OM030319 OM030320').split()
+
+
+def create_example_seqs_file():
+    """
+    Function to create the example sequences file in the tests/data folder
+    """
+    from sugar.web import Entrez
+    seqs = Entrez().get_basket(_IDS)
+    for seq in seqs:
+        seq.fts = seq.fts.select('cds')
+    fname = os.path.join(os.path.dirname(__file__), 'pesti56.gff')
+    seqs.write(fname, archive='zip')
+
+
+if __name__ == '__main__':
+    create_example_seqs_file()
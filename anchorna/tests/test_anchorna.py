@@ -1,13 +1,13 @@
 # (C) 2024, Tom Eulenfeld, MIT license
 import contextlib
+import gzip
 from importlib.resources import files
-import io
+from io import StringIO
 import os
-from pathlib import Path
-from subprocess import check_output
+import re
+import shutil
 import sys
-import tempfile
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock
 from warnings import warn
 
 import pytest
@@ -15,48 +15,102 @@ from sugar import read
 
 from anchorna import cutout, read_anchors
 from anchorna.cli import run_cmdline
-from anchorna.io import load_json, write_json
+from anchorna.io import export_dialign, export_jalview, load_json, write_json
+from anchorna.util import corrscore, corrscore_matrix, corrscores
 
 
-_IDS = (  # Representative sequences of pesti virus
-    'NC_076029 NC_001461 KC853440 JX419398 M96687 KT951841 ON165517 KX577637 '
-    'MW054939 AF526381 JQ799141 NC_076032 NC_039237 MH231152 KT875135 '
-    'MH806436 HG426490 MK599227 JN380086 NC_038912 NC_002657 OM817567 '
-    'GU233732 KP343640 KC533775 AY805221 AF099102 AY775178 MG387218 '
-    'NC_003679 MF102261 NC_024018 NC_023176 NC_003678 NC_012812 NC_018713 '
-    'NC_025677 NC_038964 NC_030653 MK216749 MH221025 MN099165 MN584738 '
-    'NC_035432 NC_077026 MZ664274 NC_077023 NC_077024 ON024093 ON024108 '
-    'NC_077001 NC_077000 NC_077015 OU592965 OM030319 OM030320').split()
+# The example sequences file in the tests/data folder is created with data/_build_fixtures.py
 
 
-def create_example_seqs_file():
+def _run(cmd):
+    args = cmd.split()
+    assert args[0] == 'anchorna'
+    run_cmdline(args[1:])
+
+
+@pytest.fixture
+def check(capsys):
     """
-    Function to create the example sequences file in the tests/data folder
+    Return function running an anchorna command and returning its output
     """
-    from sugar.web import Entrez
-    seqs = Entrez().get_basket(_IDS)
-    for seq in seqs:
-        seq.fts = seq.fts.select('cds')
-    seqs.write('data/pesti56.gff', archive='zip')
+    def check(cmd):
+        capsys.readouterr()
+        _run(cmd)
+        return capsys.readouterr().out
+    return check
 
 
-@contextlib.contextmanager
-def _changetmpdir():
-    origin = Path().resolve()
-    with tempfile.TemporaryDirectory() as tmpdir:
-        try:
-            os.chdir(tmpdir)
-            yield Path(tmpdir)
-        finally:
-            os.chdir(origin)
+@pytest.fixture(scope='session')
+def baseline_dir(tmp_path_factory):
+    """
+    Directory with tutorial subset and anchors found with default options
 
+    The anchors are calculated only once per test session.
+    """
+    path = tmp_path_factory.mktemp('baseline')
+    with contextlib.chdir(path):
+        _run('anchorna create')
+        _run('anchorna create --tutorial-subset')
+        _run('anchorna go --no-pbar anchors.gff')
+        _fix_open_log_file_on_windows()
+    return path
 
-def check(cmd):
-    args = cmd.split()
-    assert args[0] == 'anchorna'
-    with contextlib.redirect_stdout(io.StringIO()) as f:
-        run_cmdline(args[1:])
-    return f.getvalue()
+
+@pytest.fixture(scope='session')
+def example_seqs(baseline_dir):
+    """
+    Sequences of the tutorial subset, read only once per test session
+
+    Tests changing the sequences have to work on a copy.
+    """
+    return read(baseline_dir / 'pesti_example.gff')
+
+
+@pytest.fixture
+def tmp_path_cd(tmp_path):
+    """
+    Change into temporary directory
+    """
+    with contextlib.chdir(tmp_path):
+        yield tmp_path
+
+
+@pytest.fixture
+def baseline_cd(baseline_dir, tmp_path_cd):
+    """
+    Change into temporary directory with a copy of the baseline files
+    """
+    shutil.copytree(baseline_dir, tmp_path_cd, dirs_exist_ok=True)
+    return tmp_path_cd
+
+
+@pytest.fixture
+def jalview(monkeypatch):
+    """
+    Replace subprocess.run, we do not want to actually start jalview in tests
+    """
+    run = MagicMock()
+    monkeypatch.setattr('subprocess.run', run)
+    return run
+
+
+def _install_tutorial_subset(baseline_dir, path):
+    """
+    Copy configuration and sequences of the tutorial subset from the baseline
+
+    Same result as calling ``anchorna create --tutorial-subset``.
+    """
+    for fname in ('anchorna.conf', 'pesti_example.gff'):
+        shutil.copy(baseline_dir / fname, path)
+
+
+def _check_cutout_pieces(seqs, anchors):
+    """
+    Check that adjacent cutouts add up to the sequence
+    """
+    pos = ['start+10', 'a5^-5', '*>', 'end']
+    pieces = [cutout(seqs, anchors, p1, p2)[0].data for p1, p2 in zip(pos[:-1], pos[1:])]
+    assert str(seqs[0, 10:]) == ''.join(pieces)
 
 
 def _fix_open_log_file_on_windows():
@@ -70,199 +124,314 @@ def _fix_open_log_file_on_windows():
         handler.close()
 
 
-def test_anchorna_script_help():
+def test_anchorna_script_help(capsys):
     """
-    Test that anchorna can be called on the command line
+    Test the help of the anchorna command line interface
     """
-    assert b'Find anchors' in check_output('anchorna -h'.split())
-    assert b'go' in check_output('anchorna go -h'.split())
-
-
-def test_reproduce_anchor_file_subset():
-    with _changetmpdir() as tmpdir:
-        check('anchorna create --tutorial-subset')
-        check('anchorna go --no-pbar anchors.gff --no-logging --no-aggressive-remove')
-        anchors = read_anchors('anchors.gff')
-        fname = files('anchorna.tests.data').joinpath('anchors_subset.gff')
-        try:
-            anchors2 = read_anchors(fname)
-        except FileNotFoundError:
-            warn(f'Did not find test file {fname}, create it')
-            import shutil
-            shutil.copy(tmpdir / 'anchors.gff', fname)
-            anchors2 = read_anchors(fname)
+    with pytest.raises(SystemExit):
+        run_cmdline(['-h'])
+    assert 'Find anchors' in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        run_cmdline(['go', '-h'])
+    assert 'go' in capsys.readouterr().out
+
+
+def test_corrscores():
+    seq = 'MKV-LAAGWXRRK'
+    for word in ('KVLA', 'A-GW', 'XX'):
+        scores = [corrscore(seq[i:i+4], word) for i in range(2, 9)]
+        assert corrscores(seq, word, 2, 9, w=4).tolist() == scores
+    with pytest.raises(KeyError):
+        corrscores('MKUV', 'MK', 0, 2)
+    words1 = ['KVLA', 'A-GW', 'XXRK']
+    words2 = ['KVLA', 'GWXR']
+    scores = [[corrscore(w1, w2) for w2 in words2] for w1 in words1]
+    assert corrscore_matrix(words1, words2).tolist() == scores
+
+
+def test_reproduce_anchor_file_subset(baseline_dir, tmp_path_cd, check):
+    _install_tutorial_subset(baseline_dir, tmp_path_cd)
+    check('anchorna go --no-pbar anchors.gff --no-logging --no-aggressive-remove')
+    anchors = read_anchors('anchors.gff')
+    fname = files('anchorna.tests.data').joinpath('anchors_subset.gff')
+    try:
+        anchors2 = read_anchors(fname)
+    except FileNotFoundError:
+        warn(f'Did not find test file {fname}, create it')
+        shutil.copy(tmp_path_cd / 'anchors.gff', fname)
+        anchors2 = read_anchors(fname)
     assert anchors2 == anchors
 
 
-def test_anchorna_workflow_subset():
+@pytest.mark.parametrize('cmd, expected', [
+    ('anchorna print anchors.gff', 'A11'),
+    ('anchorna print anchors.gff -v', 'F1'),
+    ('anchorna export anchors.gff', 'anchorna'),
+    ('anchorna export --fmt jalview anchors.gff', 'anchor0'),
+    ('anchorna export --fmt dialign anchors.gff', '1'),
+    ('anchorna cutout anchors.gff atg>+5 end-10 --fname pesti_example.gff', '>'),
+    ])
+def test_anchorna_workflow_subset_output(baseline_cd, check, cmd, expected):
+    """
+    Test output of commands for anchors of a subset of the example sequences
+    """
+    assert expected in check(cmd)
+
+
+@pytest.mark.parametrize('fmt, mode, expected', [
+    ('jalview', 'aa', 'anchor0'),
+    ('jalview', 'nt', 'anchor0'),
+    ('gff', 'aa', 'anchorna'),
+    ('gff', 'nt', 'anchorna'),
+    ('dialign', 'aa', '1'),
+    ('dialign', 'nt', '1'),
+    ('dialign', 'cds', '1'),
+    ])
+def test_export(baseline_dir, example_seqs, fmt, mode, expected):
+    """
+    Test export functions directly, the CLI is tested above
+    """
+    anchors = read_anchors(baseline_dir / 'anchors.gff')
+    if fmt == 'jalview':
+        out = export_jalview(anchors, mode=mode)
+    elif fmt == 'dialign':
+        out = export_dialign(anchors, example_seqs.ids, mode=mode)
+    else:
+        f = StringIO()
+        anchors.write(f, mode=mode)
+        out = f.getvalue()
+    assert expected in out
+
+
+def test_anchorna_workflow_subset(baseline_cd, check):
     """
     Tests the full anchorna workflow with a subset of the example sequences
     """
-    with _changetmpdir() as tmpdir:
-        assert '' == check('anchorna create')
-        fname_seqs = tmpdir / 'pesti_example.gff'
-        assert '' == check('anchorna create --tutorial-subset')
-        assert '' == check('anchorna go --no-pbar anchors.gff')
-        assert 'A11' in check('anchorna print anchors.gff')
-        assert 'F1' in check('anchorna print anchors.gff -v')
-        out1 = check('anchorna combine anchors.gff|a5:a10|a8')
-        out2 = check('anchorna combine anchors.gff|a5,a6,a7,a9')
-        assert out1 == out2
-        assert 'anchor0' in check('anchorna export --fmt jalview anchors.gff')
-        assert 'anchor0' in check('anchorna export --fmt jalview -m nt anchors.gff')
-        assert 'anchor0' in check('anchorna export --fmt jalview -m aa anchors.gff')
-        assert '' in check('anchorna export --fmt jalview -m cds anchors.gff -o test_jalview.txt')
-        assert 'anchorna' in check('anchorna export anchors.gff')
-        assert 'anchorna' in check('anchorna export -m nt anchors.gff')
-        assert 'anchorna' in check('anchorna export -m aa anchors.gff')
-        assert '' in check('anchorna export -m cds anchors.gff -o test_anchor_export.gff')
-        with pytest.raises(IOError):
-            read_anchors('test_anchor_export.gff')
-        read_anchors('test_anchor_export.gff', check_header=False)
-        assert '1' in check('anchorna export --fmt dialign anchors.gff')
-        assert '1' in check('anchorna export --fmt dialign -m nt anchors.gff')
-        assert '1' in check('anchorna export --fmt dialign -m cds anchors.gff')
-        with patch('subprocess.run'):  # we do not want to actually start jalview here
-            assert '' == check('anchorna view anchors.gff')
-            assert '' == check('anchorna view anchors.gff --align a1')
-
-        anchors = read_anchors('anchors.gff')
-
-        # test cutout
-        assert '>' in check(f'anchorna cutout anchors.gff atg>+5 end-10 --fname {fname_seqs}')
-
-        seqs = read(fname_seqs)
-        seqs2 = cutout(seqs, anchors, 'start+10', 'a5^-5')
-        seqs3 = cutout(seqs, anchors, 'a5^-5', '*>')
-        seqs4 = cutout(seqs, anchors, '*>', 'end')
-        assert str(seqs[0, 10:]) == seqs2[0].data + seqs3[0].data + seqs4[0].data
-
-        fname = tmpdir / 'pesti_test_cutout.sjson'
-        assert '' == check(f'anchorna cutout anchors.gff a0> a2< -o {fname}')
-        assert '' == check(f'anchorna go --fname {fname} --no-pbar anchors_cutout.gff')
-        assert '' == check('anchorna combine anchors.gff||a1 anchors_cutout.gff -o anchors_combined.gff')
-        assert read_anchors('anchors_combined.gff') == anchors
-
-        fname = tmpdir / 'pesti_test_cutout2.sjson'
-        assert '' == check(f'anchorna cutout anchors.gff a6> a10< -o {fname}')
-        assert '' == check(f'anchorna go --fname {fname} --no-pbar anchors_cutout2.gff --search-range=1000')
-        assert '' == check('anchorna combine anchors.gff||a7:a10 anchors_cutout2.gff -o anchors_combined2.gff')
-        assert read_anchors('anchors_combined2.gff') == read_anchors('anchors.gff')
-
-        # check --no-remove option and --continue-with option
-        assert '' == check('anchorna go --no-remove --no-pbar anchors2.gff')
-        assert '' == check('anchorna go --continue-with anchors2.gff --no-pbar anchors3.gff')
-        assert len(anchors) < len(read_anchors('anchors2.gff'))
-        assert anchors == read_anchors('anchors3.gff')
-
-        # test json
-        json = tmpdir / 'anchors.json'
-        write_json(anchors, json)
-        assert load_json(json) == anchors
+    out1 = check('anchorna combine anchors.gff|a5:a10|a8')
+    out2 = check('anchorna combine anchors.gff|a5,a6,a7,a9')
+    assert out1 == out2
+    assert '' in check('anchorna export --fmt jalview -m cds anchors.gff -o test_jalview.txt')
+    assert '' in check('anchorna export -m cds anchors.gff -o test_anchor_export.gff')
+    with pytest.raises(IOError):
+        read_anchors('test_anchor_export.gff')
+    read_anchors('test_anchor_export.gff', check_header=False)
+
+
+@pytest.mark.parametrize('backend', ['orjson', 'json'])
+def test_json(baseline_cd, monkeypatch, backend):
+    """
+    Test JSON round trip with orjson and with the json module
+    """
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr('anchorna.io.orjson', None)
+    anchors = read_anchors('anchors.gff')
+    json = baseline_cd / 'anchors.json'
+    write_json(anchors, json)
+    assert load_json(json) == anchors
+    # stdout and stdin replaced by text streams without binary buffer
+    with contextlib.redirect_stdout(StringIO()) as f:
+        write_json(anchors, '-')
+    monkeypatch.setattr('sys.stdin', StringIO(f.getvalue()))
+    assert load_json('-') == anchors
+
+
+@pytest.mark.parametrize('align', [None, 'a1'])
+def test_anchorna_view(baseline_cd, check, jalview, align):
+    """
+    Test anchorna view, jalview is not started
+    """
+    cmd = 'anchorna view anchors.gff' + (f' --align {align}' if align else '')
+    assert '' == check(cmd)
+    assert jalview.call_count == 1
+    assert jalview.call_args.args[0][0] == 'jalview'
 
-        _fix_open_log_file_on_windows()
 
+def test_anchorna_workflow_subset_cutout(baseline_cd, example_seqs, check):
+    """
+    Test cutout and anchor search on cut out sequences
+    """
+    tmpdir = baseline_cd
+    anchors = read_anchors('anchors.gff')
+    _check_cutout_pieces(example_seqs.copy(), anchors)
 
-def test_anchorna_workflow_subset_poor():
-    with _changetmpdir() as tmpdir:
-        assert '' == check('anchorna create')
-        fname_seqs = tmpdir / 'pesti_example.gff'
-        assert '' == check('anchorna create --tutorial-subset')
-        assert '' == check('anchorna go --thr-quota-add-anchor 0.5 --score-add-word 18 --no-pbar anchors.gff')
-        assert 'A11' in check('anchorna print anchors.gff')
-        assert '(poor)' in check('anchorna print anchors.gff -v')
-        out1 = check('anchorna combine anchors.gff|a5:a10|a8')
-        out2 = check('anchorna combine anchors.gff|a5,a6,a7,a9')
-        assert out1 == out2
-        assert 'anchor0' in check('anchorna export --fmt jalview anchors.gff')
-        assert 'anchorna' in check('anchorna export anchors.gff')
-        with patch('subprocess.run'):  # we do not want to actually start jalview here
-            assert '' == check('anchorna view anchors.gff')
-        anchors = read_anchors('anchors.gff')
-        check(f'anchorna cutout anchors.gff atg>+5 end-10 --fname {fname_seqs}')
-        seqs = read(fname_seqs)
-        seqs2 = cutout(seqs, anchors, 'start+10', 'a5^-5')
-        seqs3 = cutout(seqs, anchors, 'a5^-5', '*>')
-        seqs4 = cutout(seqs, anchors, '*>', 'end')
-        assert str(seqs[0, 10:]) == seqs2[0].data + seqs3[0].data + seqs4[0].data
+    fname = tmpdir / 'pesti_test_cutout.sjson'
+    assert '' == check(f'anchorna cutout anchors.gff a0> a2< -o {fname}')
+    assert '' == check(f'anchorna go --fname {fname} --no-pbar anchors_cutout.gff')
+    assert '' == check('anchorna combine anchors.gff||a1 anchors_cutout.gff -o anchors_combined.gff')
+    assert read_anchors('anchors_combined.gff') == anchors
 
-        _fix_open_log_file_on_windows()
+    fname = tmpdir / 'pesti_test_cutout2.sjson'
+    assert '' == check(f'anchorna cutout anchors.gff a6> a10< -o {fname}')
+    assert '' == check(f'anchorna go --fname {fname} --no-pbar anchors_cutout2.gff --search-range=1000')
+    assert '' == check('anchorna combine anchors.gff||a7:a10 anchors_cutout2.gff -o anchors_combined2.gff')
+    assert read_anchors('anchors_combined2.gff') == read_anchors('anchors.gff')
+    _fix_open_log_file_on_windows()
 
 
-def test_anchorna_workflow_subset_no_cds():
-    with _changetmpdir() as tmpdir:
-        assert '' == check('anchorna create')
-        fname_seqs = tmpdir / 'pesti_example.gff'
-        assert '' == check('anchorna create --tutorial-subset --no-cds')
-        assert '' == check('anchorna go --no-pbar anchors.gff')
-        anchors1 = read_anchors('anchors.gff')
-        assert anchors1.no_cds
-
-        assert '' == check('anchorna create --tutorial-subset')
-        assert '' == check('anchorna go --no-pbar anchors_cds.gff')
-        anchors2 = read_anchors('anchors_cds.gff')
-        anchors2.no_cds = True
-        for anchor in anchors2:
-            for fluke in anchor:
-                fluke.offset = 0
-        assert anchors1 == anchors2
-
-        assert 'A11' in check('anchorna print anchors.gff')
-        assert 'F1' in check('anchorna print anchors.gff -v')
-        out1 = check('anchorna combine anchors.gff|a5:a10|a8')
-        out2 = check('anchorna combine anchors.gff|a5,a6,a7,a9')
-        assert out1 == out2
-        assert 'anchor0' in check('anchorna export --fmt jalview anchors.gff')
-        assert 'anchor0' in check('anchorna export --fmt jalview -m nt anchors.gff')
-        assert 'anchorna' in check('anchorna export anchors.gff')
-        with patch('subprocess.run'):  # we do not want to actually start jalview here
-            assert '' == check('anchorna view anchors.gff')
-            assert '' == check('anchorna view anchors.gff --align a1')
-        anchors = read_anchors('anchors.gff')
-        with pytest.raises(ValueError):
-            check(f'anchorna cutout anchors.gff atg>+5 end-10 --fname {fname_seqs}')
-        seqs = read(fname_seqs)
-        seqs2 = cutout(seqs, anchors, 'start+10', 'a5^-5')
-        seqs3 = cutout(seqs, anchors, 'a5^-5', '*>')
-        seqs4 = cutout(seqs, anchors, '*>', 'end')
-        assert str(seqs[0, 10:]) == seqs2[0].data + seqs3[0].data + seqs4[0].data
+def test_anchorna_workflow_subset_continue_with(baseline_cd, check):
+    """
+    Test --no-remove option and --continue-with option
+    """
+    anchors = read_anchors('anchors.gff')
+    assert '' == check('anchorna go --no-remove --no-pbar anchors2.gff')
+    assert '' == check('anchorna go --continue-with anchors2.gff --no-pbar anchors3.gff')
+    assert len(anchors) < len(read_anchors('anchors2.gff'))
+    assert anchors == read_anchors('anchors3.gff')
+    _fix_open_log_file_on_windows()
+
+
+def test_read_anchors_cache(baseline_cd):
+    anchors = read_anchors('anchors.gff')
+    # changing returned anchors does not change the cached anchors
+    anchors[0][0].start += 1
+    anchors.data.pop()
+    anchors2 = read_anchors('anchors.gff')
+    assert anchors2 != anchors
+    assert anchors2 == read_anchors('anchors.gff')
+    assert anchors2 == read_anchors(baseline_cd / 'anchors.gff')
+    # changed file is read again
+    anchors2[:3].write('anchors.gff')
+    assert len(read_anchors('anchors.gff')) == 3
+    assert len(read_anchors('anchors.gff|0:2')) == 2
+
+
+def test_read_anchors_gzip(baseline_cd):
+    anchors = read_anchors('anchors.gff')
+    with open('anchors.gff', 'rb') as f1, gzip.open('anchors.gff.gz', 'wb') as f2:
+        shutil.copyfileobj(f1, f2)
+    assert read_anchors('anchors.gff.gz') == anchors
+    assert len(read_anchors('anchors.gff.gz|0:2')) == 2
+
+
+def test_anchorna_workflow_subset_poor(baseline_dir, example_seqs, tmp_path_cd, check, jalview):
+    tmpdir = tmp_path_cd
+    fname_seqs = tmpdir / 'pesti_example.gff'
+    _install_tutorial_subset(baseline_dir, tmpdir)
+    assert '' == check('anchorna go --thr-quota-add-anchor 0.5 --score-add-word 18 --no-pbar anchors.gff')
+    assert 'A11' in check('anchorna print anchors.gff')
+    assert '(poor)' in check('anchorna print anchors.gff -v')
+    out1 = check('anchorna combine anchors.gff|a5:a10|a8')
+    out2 = check('anchorna combine anchors.gff|a5,a6,a7,a9')
+    assert out1 == out2
+    assert 'anchor0' in check('anchorna export --fmt jalview anchors.gff')
+    assert 'anchorna' in check('anchorna export anchors.gff')
+    assert '' == check('anchorna view anchors.gff')
+    anchors = read_anchors('anchors.gff')
+    check(f'anchorna cutout anchors.gff atg>+5 end-10 --fname {fname_seqs}')
+    _check_cutout_pieces(example_seqs.copy(), anchors)
+
+    _fix_open_log_file_on_windows()
+
+
+def test_anchorna_workflow_subset_no_cds(baseline_dir, example_seqs, tmp_path_cd, check, jalview):
+    tmpdir = tmp_path_cd
+    fname_seqs = tmpdir / 'pesti_example.gff'
+    assert '' == check('anchorna create --tutorial-subset --no-cds')
+    assert '' == check('anchorna go --no-pbar anchors.gff')
+    anchors1 = read_anchors('anchors.gff')
+    assert anchors1.no_cds
+
+    # use configuration, sequences and anchors of the baseline with CDS
+    shutil.copy(baseline_dir / 'anchorna.conf', tmpdir)
+    shutil.copy(baseline_dir / 'pesti_example.gff', tmpdir)
+    shutil.copy(baseline_dir / 'anchors.gff', tmpdir / 'anchors_cds.gff')
+    anchors2 = read_anchors('anchors_cds.gff')
+    anchors2.no_cds = True
+    for anchor in anchors2:
+        for fluke in anchor:
+            fluke.offset = 0
+    assert anchors1 == anchors2
+
+    assert 'A11' in check('anchorna print anchors.gff')
+    assert 'F1' in check('anchorna print anchors.gff -v')
+    out1 = check('anchorna combine anchors.gff|a5:a10|a8')
+    out2 = check('anchorna combine anchors.gff|a5,a6,a7,a9')
+    assert out1 == out2
+    assert 'anchor0' in check('anchorna export --fmt jalview anchors.gff')
+    assert 'anchor0' in check('anchorna export --fmt jalview -m nt anchors.gff')
+    assert 'anchorna' in check('anchorna export anchors.gff')
+    assert '' == check('anchorna view anchors.gff')
+    assert '' == check('anchorna view anchors.gff --align a1')
+    anchors = read_anchors('anchors.gff')
+    with pytest.raises(ValueError):
+        check(f'anchorna cutout anchors.gff atg>+5 end-10 --fname {fname_seqs}')
+    _check_cutout_pieces(example_seqs.copy(), anchors)
 
-        _fix_open_log_file_on_windows()
+    _fix_open_log_file_on_windows()
 
 
 @pytest.mark.slowtest
-def test_reproduce_anchor_file_complete():
-    with _changetmpdir() as tmpdir:
-        check('anchorna create --tutorial')
-        check('anchorna go --no-pbar anchors.gff --no-logging --njobs=-1')
-        anchors = read_anchors('anchors.gff')
-        fname = files('anchorna.tests.data').joinpath('anchors_complete.gff')
-        try:
-            anchors2 = read_anchors(fname)
-        except FileNotFoundError:
-            warn(f'Did not find test file {fname}, create it')
-            import shutil
-            shutil.copy(tmpdir / 'anchors.gff', fname)
-            anchors2 = read_anchors(fname)
+def test_reproduce_anchor_file_complete(tmp_path_cd, check):
+    check('anchorna create --tutorial')
+    check('anchorna go --no-pbar anchors.gff --no-logging --njobs=-1')
+    anchors = read_anchors('anchors.gff')
+    fname = files('anchorna.tests.data').joinpath('anchors_complete.gff')
+    try:
+        anchors2 = read_anchors(fname)
+    except FileNotFoundError:
+        warn(f'Did not find test file {fname}, create it')
+        shutil.copy(tmp_path_cd / 'anchors.gff', fname)
+        anchors2 = read_anchors(fname)
     assert anchors2 == anchors
 
 
-@pytest.mark.slowtest
-def test_tutorial():
+_TUTORIAL_BLOCK = re.compile(r'(anchorna go.*?)```', re.DOTALL)
+_TUTORIAL_CMD = re.compile(r'^anchorna.*$', re.MULTILINE)
+
+
+def _tutorial_cmds():
+    """
+    Return commands of the tutorial in README.md, empty list if README is not available
+    """
     fname = files('anchorna').joinpath('../README.md')
     if not os.path.exists(fname):
-        pytest.skip('README.md only available in dev install')
+        return []
     with open(fname) as f:
         readme = f.read()
-    i1 = readme.find('anchorna go')
-    i2 = readme.find('```', i1) + i1
-    tutorial = 'anchorna create --tutorial\n' + readme[i1:i2]
+    tutorial = _TUTORIAL_BLOCK.search(readme).group(1)
     tutorial = tutorial.replace('"A??>" "A??<"', '"A33>" "A34<"')
-    sys.modules['IPython'] = MagicMock()
-    with _changetmpdir():
-        with patch('subprocess.run'):
-            for line in tutorial.splitlines():
-                if line.startswith('anchorna'):
-                    line = line.replace('| anchorna view -', '').replace('"', '')
-                    line = line.split('#')[0].strip()
-                    check(line)
+    cmds = []
+    for line in _TUTORIAL_CMD.findall(tutorial):
+        line = line.replace('| anchorna view -', '').replace('"', '')
+        cmds.append(line.split('#')[0].strip())
+    return cmds
+
+
+_TUTORIAL_CMDS = _tutorial_cmds()
+
+
+def _writes_file(cmd):
+    return cmd.startswith('anchorna go') or ' -o ' in cmd
+
+
+@pytest.fixture(scope='session')
+def tutorial_dir(tmp_path_factory):
+    """
+    Directory with tutorial files and all files written by tutorial commands
+
+    The anchors and other files are calculated only once per test session.
+    """
+    assert _TUTORIAL_CMDS[0].startswith('anchorna go')
+    path = tmp_path_factory.mktemp('tutorial')
+    with contextlib.chdir(path):
+        _run('anchorna create --tutorial')
+        for cmd in _TUTORIAL_CMDS:
+            if _writes_file(cmd):
+                _run(cmd)
+        _fix_open_log_file_on_windows()
+    return path
+
+
+@pytest.mark.slowtest
+@pytest.mark.parametrize('k', range(1, len(_TUTORIAL_CMDS)),
+                         ids=lambda k: _TUTORIAL_CMDS[k])
+def test_tutorial(tutorial_dir, tmp_path_cd, check, jalview, monkeypatch, k):
+    """
+    Test a single tutorial command, files written by other commands are copied
+    """
+    monkeypatch.setitem(sys.modules, 'IPython', MagicMock())
+    shutil.copytree(tutorial_dir, tmp_path_cd, dirs_exist_ok=True)
+    check(_TUTORIAL_CMDS[k])
+    _fix_open_log_file_on_windows()
@@ -5,9 +5,11 @@
 
 import collections
 import logging
+from operator import is_
 from statistics import median
 from warnings import warn
 
+import numpy as np
 from sugar.core.meta import Attr
 
 log = logging.getLogger('anchorna')
@@ -21,6 +23,120 @@ def corrscore(seq1, seq2, gap='-', sm=None):
     return sum(sm[nt1][nt2] for nt1, nt2 in zip(seq1, seq2) if nt1 != gap and nt2 != gap)
 
 
+# keep a reference to the substitution matrix, so that its id stays unique
+_SUBMAT_TABLES = {}
+
+
+def _submat_table(sm, gap='-'):
+    """
+    Substitution matrix as array together with a translation table for letter indices, cached
+
+    Gaps are mapped to the last row and column of the matrix, which are zero.
+    Unknown letters are mapped to index 255.
+    Return ``(None, None)`` if the matrix cannot be converted.
+    """
+    key = (id(sm), gap)
+    if key not in _SUBMAT_TABLES:
+        letters = list(sm)
+        lut = bytearray([255]) * 256
+        try:
+            if len(letters) >= 255:
+                raise ValueError('too many letters')
+            vals = [[sm[l1][l2] for l2 in letters] for l1 in letters]
+            for k, l in enumerate(letters):
+                lut[ord(l)] = k
+        except (KeyError, IndexError, TypeError, ValueError):
+            table = lut = None
+        else:
+            isint = all(isinstance(v, int) for row in vals for v in row)
+            table = np.zeros((len(letters) + 1,) * 2, dtype=np.int64 if isint else np.float64)
+            table[:-1, :-1] = vals
+            if len(gap) == 1 and ord(gap) < 256:
+                lut[ord(gap)] = len(letters)
+            lut = bytes(lut)
+        _SUBMAT_TABLES[key] = (sm, table, lut)
+    return _SUBMAT_TABLES[key][1:]
+
+
+def _encode(seq, lut):
+    """
+    Encode string as array of letter indices, return None for unknown letters
+    """
+    try:
+        codes = seq.encode('latin-1').translate(lut)
+    except UnicodeEncodeError:
+        return
+    if 255 in codes:
+        return
+    return np.frombuffer(codes, dtype=np.uint8)
+
+
+def corrscores(seq, word, start, stop, w=None, gap='-', sm=None):
+    """
+    Similarity scores between a word and all words in a sequence starting between start and stop
+
+    Same result as
+    ``[corrscore(seq[i:i+w], word) for i in range(start, stop)]``,
+    but the scores are calculated with a vectorized lookup in the substitution matrix.
+
+    :return: array of scores
+    """
+    if sm is None:
+        from sugar.data import submat
+        sm = submat('blosum62')
+    if w is None:
+        w = len(word)
+    n = min(w, len(word))
+    stop = max(start, stop)
+    table, lut = _submat_table(sm, gap=gap)
+    if table is not None:
+        seqind = _encode(seq[start:stop+n-1], lut)
+        wordind = _encode(word[:n], lut)
+    if table is None or seqind is None or wordind is None or len(seqind) < stop - start + n - 1:
+        # fallback to pure Python
+        return np.array([corrscore(seq[i:i+w], word, gap=gap, sm=sm) for i in range(start, stop)])
+    scores = np.zeros(stop - start, dtype=table.dtype)
+    for k in range(n):
+        scores += table[wordind[k], seqind[k:k+stop-start]]
+    return scores
+
+
+def corrscore_matrix(words1, words2, gap='-', sm=None):
+    """
+    Similarity scores between all pairs of words
+
+    Same result as
+    ``[[corrscore(w1, w2) for w2 in words2] for w1 in words1]``,
+    but the scores are calculated with a vectorized lookup in the substitution matrix,
+    if all words have the same length.
+
+    :return: array of scores with shape ``(len(words1), len(words2))``
+    """
+    if sm is None:
+        from sugar.data import submat
+        sm = submat('blosum62')
+    table, lut = _submat_table(sm, gap=gap)
+    lens = {len(w) for w in words1} | {len(w) for w in words2}
+    if table is not None and len(lens) == 1 and len(words1) > 0 and len(words2) > 0:
+        ind1 = _encode(''.join(words1), lut)
+        ind2 = _encode(''.join(words2), lut)
+        if ind1 is not None and ind2 is not None:
+            n = lens.pop()
+            ind1 = ind1.reshape(len(words1), 1, n)
+            ind2 = ind2.reshape(1, len(words2), n)
+            if table.dtype.kind == 'i':
+                # integer sums are exact, gather and sum in one go
+                return table[ind1, ind2].sum(axis=-1)
+            # sum up letter by letter to preserve the summation order of corrscore
+            scores = np.zeros((len(words1), len(words2)), dtype=table.dtype)
+            for k in range(n):
+                scores += table[ind1[..., k], ind2[..., k]]
+            return scores
+    # fallback to pure Python
+    scores = [[corrscore(w1, w2, gap=gap, sm=sm) for w2 in words2] for w1 in words1]
+    return np.array(scores).reshape(len(words1), len(words2))
+
+
 class Fluke(Attr):
     """
     A fluke is a word position on a single sequence and part of an `Anchor`
@@ -53,6 +169,9 @@ class Anchor(collections.UserList):
     Some properties: data (list of flukes), id, gseqid, guide,
     minscore (aka score), maxscore, medscore.
     """
+    # slot is not part of __dict__, i.e. the cache is not written to JSON
+    __slots__ = ('_sorted_cache',)
+
     def __init__(self, data=None, **kw):
         super().__init__(data)
         for k, v in kw.items():
@@ -63,10 +182,12 @@ class Anchor(collections.UserList):
 
     @property
     def id(self):
-        return f'A {self.guide.start}+{self.guide.len}'
+        guide = self.guide
+        return f'A {guide.start}+{guide.len}'
 
     def __hash__(self):
-        return hash((self.guide.start, self.guide.len, self.guide.offset))
+        guide = self.guide
+        return hash((guide.start, guide.len, guide.offset))
 
     def todict_seqid(self):
         return {f.seqid: f for f in self}
@@ -80,26 +201,60 @@ class Anchor(collections.UserList):
         return [f.seqid for f in self]
 
     def tostr(self, i='', verbose=False, mode='aa'):
-        ind = _apply_mode(self.guide.start, self.guide.offset, mode=mode)
-        len_ = _apply_mode(self.guide.len, self.guide.offset,
+        guide = self.guide
+        ind = _apply_mode(guide.start, guide.offset, mode=mode)
+        len_ = _apply_mode(guide.len, guide.offset,
                            mode=mode, islen=True)
         poor = sum(f.poor for f in self)
-        out = f'A{i} {ind}+{len_}  minscore {self.minscore}  poor {poor}  {self.guide.word}'
+        out = f'A{i} {ind}+{len_}  minscore {self.minscore}  poor {poor}  {guide.word}'
         if not verbose:
             return out
         flukes = [f'  F{j} {_apply_mode(f.start, f.offset, mode=mode)}  medscore {f.median_score}  {f.word}  {f.seqid}' + '  (poor)' * f.poor
                   for j, f in enumerate(self)]
         return '\n'.join([out]+flukes)
 
+    def _default_sort_key(self, f):
+        # guiding fluke first, then good flukes and poor flukes sorted by seqid
+        return (False, '') if f.seqid == self.gseqid else (f.poor, f.seqid)
+
     def sort(self, key=None, **kw):
         if key is None:
-            def key(f): return (False, '') if f.seqid == self.gseqid else (f.poor, f.seqid)
+            key = self._default_sort_key
         self.data = sorted(self.data, key=key, **kw)
         return self
 
+    def _sorted_flukes(self):
+        """
+        Return tuples of all flukes and good flukes in default sort order, cached
+
+        The cache is invalidated if flukes are added, removed, replaced or reordered,
+        e.g. by `sort()` with a custom key, or if the guiding sequence changes.
+        Seqid and poor attribute of the flukes are not expected to change.
+        """
+        data = self.data
+        cache = getattr(self, '_sorted_cache', None)
+        if (cache is None or cache[0] != self.gseqid or len(cache[1]) != len(data) or
+                not all(map(is_, cache[1], data))):
+            flukes = tuple(sorted(data, key=self._default_sort_key))
+            good = tuple(f for f in flukes if not f.poor)
+            good_seqids = frozenset(f.seqid for f in good)
+            cache = self._sorted_cache = (self.gseqid, tuple(data), flukes, good, good_seqids)
+        return cache[2:4]
+
+    def _good_seqids(self):
+        """
+        Return frozenset of seqids of good flukes, cached together with `_sorted_flukes()`
+        """
+        self._sorted_flukes()
+        return self._sorted_cache[4]
+
     @property
     def guide(self):
-        return self.sid[self.gseqid]
+        # the guiding fluke is the first one in the default sort order
+        flukes, _ = self._sorted_flukes()
+        if len(flukes) == 0 or flukes[0].seqid != self.gseqid:
+            raise KeyError(self.gseqid)
+        return flukes[0]
 
     @property
     def minscore(self):
@@ -124,16 +279,28 @@ class Anchor(collections.UserList):
         return Anchor(data, gseqid=self.gseqid)
 
     def nicely_overlaps_with(self, a2):
-        a1 = self.good_flukes
-        a2 = a2.good_flukes
-        return (max(a1.guide.start, a2.guide.start) <= min(a1.guide.stop, a2.guide.stop) and
-                set(a1.seqids) == set(a2.seqids) and
-                all((f1.start - f2.start == a1.guide.start - a2.guide.start and f1.poor == f2.poor) for f1, f2 in zip(a1.sort(), a2.sort())))
+        g1 = self.guide
+        g2 = a2.guide
+        # cheap checks first
+        if max(g1.start, g2.start) > min(g1.stop, g2.stop):
+            return False
+        if self._good_seqids() != a2._good_seqids():
+            return False
+        _, good1 = self._sorted_flukes()
+        _, good2 = a2._sorted_flukes()
+        shift = g1.start - g2.start
+        return all((f1.start - f2.start == shift and f1.poor == f2.poor) for f1, f2 in zip(good1, good2))
 
     def join_with(self, a2):
-        a1 = self
-        if not a1.nicely_overlaps_with(a2):
+        if not self.nicely_overlaps_with(a2):
             raise ValueError('Cannot join anchors which do not overlap')
+        return self._join_with(a2)
+
+    def _join_with(self, a2):
+        """
+        Join with anchor, which is already known to overlap nicely
+        """
+        a1 = self
         if a1.guide.start <= a2.guide.start and a1.guide.stop >= a2.guide.stop:
             # a2 is contained in a1
             return a1
@@ -144,7 +311,7 @@ class Anchor(collections.UserList):
             # overlap
             flukes = []
             correctl = None
-            for f1, f2 in zip(a1.sort(), a2.sort()):
+            for f1, f2 in zip(a1._sorted_flukes()[0], a2._sorted_flukes()[0]):
                 assert f1.seqid == f2.seqid
                 assert f1.poor == f2.poor
                 assert f1.offset == f2.offset
@@ -180,20 +347,21 @@ class Anchor(collections.UserList):
             return anchor
 
     def _calculate_fluke_scores(self):
-        words = {fluke.word for fluke in self if not fluke.poor}
+        words = list({fluke.word for fluke in self if not fluke.poor})
+        # conserved flukes share the same word, score each word only once
+        fwords = list({fluke.word for fluke in self})
+        scores = corrscore_matrix(fwords, words).tolist()
+        stats = {w: (max(ws), median(ws)) for w, ws in zip(fwords, scores)}
         for fluke in self:
-            scores = [corrscore(fluke.word, w) for w in words]
-            fluke.score = max(scores)
-            fluke.median_score = median(scores)
+            fluke.score, fluke.median_score = stats[fluke.word]
 
     def contradicts(self, a2, aggressive=True):
         a1 = self
         if a1.guide.start > a2.guide.start:
             a1, a2 = a2, a1
-        a1 = a1.good_flukes
-        a2 = a2.good_flukes
         attr = 'stop' if aggressive else 'start'
-        return not all(getattr(f1, attr) <= f2.start for f1, f2 in zip(a1.sort(), a2.sort()))
+        return not all(getattr(f1, attr) <= f2.start
+                       for f1, f2 in zip(a1._sorted_flukes()[1], a2._sorted_flukes()[1]))
 
 
 class AnchorList(collections.UserList):
@@ -234,20 +402,26 @@ class AnchorList(collections.UserList):
         """
         Remove overlapping anchors, step B of ``anchorna go``
         """
+        # sweep over anchors sorted by start, only anchors starting before
+        # the stop of the current anchor can overlap with it
         self.sort()
-        already_merged = set()
+        data = self.data
+        starts = [a.guide.start for a in data]
+        merged = [False] * len(data)
         ndata = []
-        for i, a1 in enumerate(self.data):
-            if a1 in already_merged:
+        for i, a1 in enumerate(data):
+            if merged[i]:
                 continue
-            for a2 in self.data[i+1:]:
-                if a2 in already_merged:
-                    continue
-                if a1.guide.stop < a2.guide.start:
+            stop = a1.guide.stop
+            for j in range(i+1, len(data)):
+                if stop < starts[j]:
                     break
-                if a1.nicely_overlaps_with(a2):
-                    a1 = a1.join_with(a2)
-                    already_merged.add(a2)
+                if merged[j]:
+                    continue
+                if a1.nicely_overlaps_with(data[j]):
+                    a1 = a1._join_with(data[j])
+                    stop = a1.guide.stop
+                    merged[j] = True
             ndata.append(a1)
         self.data = ndata
         return self
@@ -259,19 +433,25 @@ class AnchorList(collections.UserList):
         # The runtime of this method can be enhanced by using an interval tree or a nested containment list.
         # But this method is not the bottleneck at all.
         anchors = sorted(self, key=lambda a: a.minscore, reverse=True)
+        minscores = [a.minscore for a in anchors]
+        # flag removed anchors by index, a set is only used for the result
+        removed = [False] * len(anchors)
         remove_anchors = set()
         for i, a1 in enumerate(anchors):
-            if a1 in remove_anchors:
+            if removed[i]:
                 continue
-            for a2 in anchors[i+1:]:
-                if a2 in remove_anchors:
+            for j in range(i+1, len(anchors)):
+                if removed[j]:
                     continue
-                assert a1 != a2 and a1.minscore >= a2.minscore
+                a2 = anchors[j]
+                assert a1 != a2 and minscores[i] >= minscores[j]
                 if a1.contradicts(a2, aggressive=aggressive):
                     log.debug(f'Remove anchor {a2.guide.start}+{a2.guide.len} with min score {a2.minscore}, '
                               f'keep anchor {a1.guide.start}+{a1.guide.len} with min score {a1.minscore}')
+                    removed[j] = True
                     remove_anchors.add(a2)
-        self.data = [anchor for anchor in self if anchor not in remove_anchors]
+        remove_ids = {id(a) for a, r in zip(anchors, removed) if r}
+        self.data = [anchor for anchor in self if id(anchor) not in remove_ids]
         return AnchorList(remove_anchors, no_cds=self.no_cds).sort()
 
     def convert2fts(self, **kw):
@@ -288,37 +468,42 @@ class AnchorList(collections.UserList):
         return write_anchors(self, fname, **kw)
 
 
-def anchors2fts(anchors, mode=None):
+def anchors2fts(anchors, mode=None, offset=True):
     """
     Convert anchors to `~sugar.core.fts.FeatureList` object
 
     Write some important attributes to ``Feature.meta._gff`` metadata.
 
     :param mode: Optionally convert anchors to ``'nt'`` or ``'cds'`` indices
+    :param offset: Write offsets to ``Feature.meta._gff`` metadata
     """
     from sugar import Feature, FeatureList
     fts = []
+    append = fts.append
     for i, a in enumerate(anchors):
-        for j, f in enumerate(a.sort()):  # fluke
-            if a.gseqid == f.seqid:
+        # sort in place, as before, but take the order from the cache
+        flukes, _ = a._sorted_flukes()
+        a.data = list(flukes)
+        gseqid = a.gseqid
+        for j, f in enumerate(flukes):  # fluke
+            seqid = f.seqid
+            if gseqid == seqid:
                 assert j == 0
                 ftype = 'anchor'
                 name = f'A{i}'
             else:
                 assert j > 0
                 ftype = 'fluke'
-                name=f'A{i}_{f.seqid}'
+                name = f'A{i}_{seqid}'
             start = _apply_mode(f.start, f.offset, mode)
             stop = _apply_mode(f.stop, f.offset, mode)
-            ft = Feature(ftype, start=start, stop=stop,
-                         meta=dict(name=name, seqid=f.seqid, score=f.score,
-                                   _gff=Attr(source='anchorna', word=f.word,
-                                             median_score=f.median_score)))
-            if hasattr(f, 'offset'):
-                ft.meta._gff.offset = f.offset
+            gff = Attr(source='anchorna', word=f.word, median_score=f.median_score)
+            if offset and hasattr(f, 'offset'):
+                gff.offset = f.offset
             if f.poor:
-                ft.meta._gff.poor = 1
-            fts.append(ft)
+                gff.poor = 1
+            append(Feature(ftype, start=start, stop=stop,
+                           meta=dict(name=name, seqid=seqid, score=f.score, _gff=gff)))
     return FeatureList(fts)
 
 